@@ -13,4 +13,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api.settings')
 
-app = get_asgi_application()
+django_app = get_asgi_application()
+
+# Imported once Django is set up by get_asgi_application()
+from monograf.views import close_shared_client, open_shared_client  # noqa: E402
+
+
+async def app(scope, receive, send):
+    """Django's ASGI application, plus lifespan events for the shared HTTP client"""
+    if scope['type'] != 'lifespan':
+        return await django_app(scope, receive, send)
+    
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await open_shared_client()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_shared_client()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -3,6 +3,7 @@ Django settings for api project.
 """
 
 import os
+import tempfile
 import environ
 
 from pathlib import Path
@@ -13,6 +14,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 env = environ.Env(
     DEBUG=(bool, False),
+    SUNRISE_USE_ANALYTIC=(bool, False),
     ALLOWED_HOSTS=(list, ['127.0.0.1', '.vercel.app']),
 )
 environ.Env.read_env()
@@ -24,6 +26,10 @@ DEBUG = env('DEBUG')
 
 API_KEY = env('API_KEY')
 
+SUNRISE_CACHE_DIR = env('SUNRISE_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'monograf-sunrise'))
+
+SUNRISE_USE_ANALYTIC = env('SUNRISE_USE_ANALYTIC')
+
 ALLOWED_HOSTS = env('ALLOWED_HOSTS')
 
 # CORS settings
@@ -55,6 +61,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'corsheaders',
     'rest_framework',
+    'adrf',
     'monograf',
 ]
 
@@ -63,13 +70,24 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'drf_orjson_renderer.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'drf_orjson_renderer.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
 ROOT_URLCONF = 'api.urls'
 
 TEMPLATES = [
@@ -99,6 +117,10 @@ ASGI_APPLICATION = 'api.asgi.app'
 
 DATABASES = {}
 
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -0,0 +1,80 @@
+import io
+
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+
+import numpy as np
+
+from django.test import SimpleTestCase
+
+from monograf.views import PowerUsageCalculatorView, _parse_time, _parse_times
+
+
+class SunriseSunsetParsingTests(SimpleTestCase):
+    def setUp(self):
+        self.view = PowerUsageCalculatorView()
+        self.first_day = date(2024, 1, 1)
+
+    def build_data(self, times):
+        """Sunrise/sunset data keyed by date, one (sunrise, sunset) pair per day from first_day"""
+        return {
+            self.first_day + timedelta(days=offset): {'sunrise': sunrise, 'sunset': sunset}
+            for offset, (sunrise, sunset) in enumerate(times)
+        }
+
+    def per_day_night_hours(self, data, day_count):
+        return np.array([
+            self.view.get_night_hours(self.first_day + timedelta(days=offset), data)
+            for offset in range(day_count)
+        ])
+
+    def test_batch_and_single_time_parsing_agree(self):
+        time_strs = ['12:05:00 AM', '12:30:00 PM', '1:00:00 AM', '1:00:00 PM', '07:12:40 AM', '11:59:59 PM']
+
+        expected = [_parse_time(time_str) for time_str in time_strs]
+
+        np.testing.assert_array_equal(_parse_times(time_strs), expected)
+        self.assertEqual(expected[:4], [5 / 60, 12.5, 1.0, 13.0])
+
+    def test_both_parsers_reject_out_of_range_hours(self):
+        for time_str in ['13:05:00 PM', '0:05:00 AM', '25:00:00 AM']:
+            with self.subTest(time_str=time_str):
+                with self.assertRaises(ValueError):
+                    _parse_time(time_str)
+                with self.assertRaises(ValueError):
+                    _parse_times([time_str])
+
+    def test_batch_matches_per_day_for_valid_data(self):
+        data = self.build_data([
+            ('7:30:00 AM', '4:15:00 PM'),
+            ('12:10:00 AM', '12:20:00 PM'),
+            ('6:05:30 AM', '9:45:10 PM'),
+        ])
+
+        batch = self.view.get_api_night_hours(self.first_day, 4, data)
+
+        np.testing.assert_array_equal(batch, self.per_day_night_hours(data, 4))
+        self.assertTrue(np.isnan(batch[3]))
+
+    def test_batch_matches_per_day_for_mixed_valid_and_malformed_data(self):
+        data = self.build_data([
+            ('7:30:00 AM', '4:15:00 PM'),
+            ('13:05:00 PM', '4:15:00 PM'),
+            ('6:05:30 AM', None),
+            ('12:10:00 AM', '12:20:00 PM'),
+        ])
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            batch = self.view.get_api_night_hours(self.first_day, 4, data)
+            per_day = self.per_day_night_hours(data, 4)
+
+        np.testing.assert_array_equal(batch, per_day)
+        self.assertEqual(np.isnan(batch).tolist(), [False, True, True, False])
+        self.assertIn('2024-01-02', output.getvalue())
+        self.assertIn('2024-01-03', output.getvalue())
+
+        # Valid days parse the same whether or not a malformed day forced the per-day fallback
+        clean_data = {day: day_data for day, day_data in data.items() if day.day in (1, 4)}
+        clean = self.view.get_api_night_hours(self.first_day, 4, clean_data)
+        np.testing.assert_array_equal(batch[[0, 3]], clean[[0, 3]])